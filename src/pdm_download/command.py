@@ -2,15 +2,21 @@ from __future__ import annotations
 
 import argparse
 import hashlib
-import re
-from collections import defaultdict
-from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import chain
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Iterable, Iterator, Sequence, cast
+from typing import TYPE_CHECKING, Any, BinaryIO, Iterable, Iterator, Sequence, cast
 
+from dep_logic.tags import EnvCompatibility
 from pdm.cli.commands.base import BaseCommand
 from pdm.cli.options import lockfile_option
-from pdm.exceptions import PdmUsageError
+from pdm.exceptions import PdmException, PdmUsageError
+from pdm.models.specifiers import PySpecSet
+from pdm.termui import is_interactive
 from rich.progress import (
     BarColumn,
     MofNCompleteColumn,
@@ -24,6 +30,7 @@ if TYPE_CHECKING:
     from typing import ContextManager, TypedDict
 
     from httpx import Client, Response
+    from pdm._types import RepositoryConfig
     from pdm.models.candidates import Candidate
     from pdm.models.markers import EnvSpec
     from pdm.project import Project
@@ -34,46 +41,134 @@ if TYPE_CHECKING:
         file: str
 
 
-def _iter_content_compat(resp: Any, chunk_size: int) -> Iterator[bytes]:
-    if hasattr(resp, "iter_content"):
-        return resp.iter_content(chunk_size)
-    return resp.iter_bytes(chunk_size)
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+
+def _ensure_pool_size(session: Any, size: int) -> None:
+    """Let a requests session keep at least ``size`` connections alive per host.
+
+    requests adapters keep 10 connections per host by default and discard the
+    extra ones. httpx sessions are built by pdm and are left untouched.
+    """
+    for adapter in getattr(session, "adapters", {}).values():
+        managers = [getattr(adapter, "poolmanager", None)]
+        managers.extend(getattr(adapter, "proxy_manager", {}).values())
+        for manager in managers:
+            if manager is None or manager.connection_pool_kw.get("maxsize", 1) >= size:
+                continue
+            manager.connection_pool_kw["maxsize"] = size
+            # Close the pools opened so far, new ones are created with the new size
+            manager.clear()
+
+
+def _iter_blocks(resp: Any, buffer: bytearray) -> Iterator[bytes | memoryview]:
+    """Iterate over the decoded response body in blocks of at most ``len(buffer)``.
+
+    For requests, the body is read into the preallocated buffer directly,
+    otherwise (httpx) the response's own chunks of the same size are yielded.
+    """
+    raw = getattr(resp, "raw", None)
+    if raw is None:
+        yield from resp.iter_bytes(len(buffer))
+        return
+    # Let urllib3 handle Content-Encoding as iter_content() would do.
+    raw.decode_content = True
+    view = memoryview(buffer)
+    while True:
+        size = raw.readinto(buffer)
+        if not size:
+            break
+        yield view[:size]
 
 
 def _stream_compat(
     session: Client, url: str, **kwargs: Any
 ) -> ContextManager[Response]:
-    if hasattr(session, "stream"):
-        return session.stream("GET", url, **kwargs)
-    return session.get(url, stream=True, **kwargs)
+    # requests.Session also has a (boolean) `stream` attribute
+    if hasattr(session, "mount"):
+        return session.get(url, stream=True, **kwargs)
+    return session.stream("GET", url, **kwargs)
+
+
+def _stream_to_file(resp: Any, fp: BinaryIO, hasher: Any) -> None:
+    """Write the response body to ``fp``, feeding the hasher in the same pass."""
+    for block in _iter_blocks(resp, bytearray(DOWNLOAD_CHUNK_SIZE)):
+        hasher.update(block)
+        fp.write(block)
+
+
+def _drop_page_cache(fp: BinaryIO) -> None:
+    """Advise the kernel that the written file won't be read again soon."""
+    if not hasattr(os, "posix_fadvise"):  # Not available on Windows and macOS
+        return
+    fp.flush()
+    try:
+        # Dirty pages are never dropped, write them back first
+        os.fdatasync(fp.fileno())
+        os.posix_fadvise(fp.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+
+
+def _verify_hash(filename: str, expected: str, hasher: Any) -> None:
+    if hasher.hexdigest() != expected:
+        raise RuntimeError(
+            f"Hash value of {filename} doesn't match. "
+            f"Expected: {expected}, got: {hasher.hexdigest()}"
+        )
+
 
+def _file_digest(path: Path, hash_name: str) -> str:
+    with path.open("rb") as fp:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(fp, hash_name).hexdigest()
+        hasher = hashlib.new(hash_name)
+        buffer = bytearray(DOWNLOAD_CHUNK_SIZE)
+        view = memoryview(buffer)
+        while True:
+            size = fp.readinto(buffer)
+            if not size:
+                break
+            hasher.update(view[:size])
+        return hasher.hexdigest()
 
-def _download_package(project: Project, package: FileHash, dest: Path) -> None:
+
+def _download_package(session: Client, package: FileHash, dest: Path) -> bool:
+    """Download the package to the destination directory.
+
+    Return False if an identical file already exists and the download is skipped.
+    """
     from unearth import Link
 
-    hash_name, hash_value = package["hash"].split(":")
+    hash_name, hash_value = package["hash"].split(":", 1)
+    filename = package.get("file", Link(package["url"]).filename)
+    target = dest / filename
+    if (
+        target.is_file()
+        and target.stat().st_size > 0
+        and _file_digest(target, hash_name) == hash_value
+    ):
+        return False
     hasher = hashlib.new(hash_name)
-    with project.environment.get_finder() as finder:
-        session = finder.session
-        with _stream_compat(session, package["url"]) as resp, dest.joinpath(
-            package.get("file", Link(package["url"]).filename)
-        ).open("wb") as fp:
+    # Write to a temporary file so that a failed download leaves nothing behind
+    part = dest / f"{filename}.part"
+    try:
+        with _stream_compat(session, package["url"]) as resp, part.open("wb") as fp:
             resp.raise_for_status()
-            for chunk in _iter_content_compat(resp, chunk_size=8192):
-                hasher.update(chunk)
-                fp.write(chunk)
-    if hasher.hexdigest() != hash_value:
-        raise RuntimeError(
-            f"Hash value of {package['file']} doesn't match. "
-            f"Expected: {hash_value}, got: {hasher.hexdigest()}"
-        )
+            _stream_to_file(resp, fp, hasher)
+            _drop_page_cache(fp)
+        _verify_hash(filename, hash_value, hasher)
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+    os.replace(part, target)
+    return True
 
 
 def _download_packages(
-    project: Project, packages: Sequence[FileHash], dest: Path
+    project: Project, packages: Sequence[FileHash], dest: Path, jobs: int
 ) -> None:
-    if not dest.exists():
-        dest.mkdir(parents=True)
+    dest.mkdir(parents=True, exist_ok=True)
 
     with Progress(
         TextColumn("[bold success]{task.description}"),
@@ -86,24 +181,53 @@ def _download_packages(
         "•",
         TaskProgressColumn(),
         transient=True,
+        # Nothing useful is drawn in CI logs, keep only the final summary
+        disable=not is_interactive(),
     ) as progress:
         task = progress.add_task("Downloading", total=len(packages))
-        success_count = 0
+        success_count = skipped_count = 0
+        # Completed downloads not yet reflected on the progress bar
+        pending = 0
+        last_refresh = time.monotonic()
+        lock = threading.Lock()
 
         def progress_callback(future: Future) -> None:
-            nonlocal success_count
-            if future.exception():
-                project.core.ui.echo(f"[error]Error: {future.exception()}", err=True)
-            else:
-                success_count += 1
-            progress.update(task, advance=1)
-
-        with ThreadPoolExecutor() as pool:
-            for package in packages:
-                future = pool.submit(_download_package, project, package, dest)
-                future.add_done_callback(progress_callback)
-
-        project.core.ui.echo(f"[success]{success_count} packages downloaded to {dest}.")
+            nonlocal success_count, skipped_count, pending, last_refresh
+            error = future.exception()
+            if error is not None:
+                project.core.ui.echo(f"[error]Error: {error}", err=True)
+            with lock:
+                if error is None:
+                    if future.result():
+                        success_count += 1
+                    else:
+                        skipped_count += 1
+                pending += 1
+                now = time.monotonic()
+                if pending < 16 and now - last_refresh < 0.1:
+                    return
+                advance, pending, last_refresh = pending, 0, now
+            progress.update(task, advance=advance)
+
+        # Share one session across all workers so connections are kept alive
+        with project.environment.get_finder() as finder:
+            session = finder.session
+            _ensure_pool_size(session, jobs)
+            with ThreadPoolExecutor(jobs) as pool:
+                # Keep at most 2 * jobs downloads queued at a time
+                inflight: set[Future] = set()
+                for package in packages:
+                    if len(inflight) >= 2 * jobs:
+                        _, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                    future = pool.submit(_download_package, session, package, dest)
+                    future.add_done_callback(progress_callback)
+                    inflight.add(future)
+        progress.update(task, advance=pending)
+
+        message = f"[success]{success_count} packages downloaded to {dest}."
+        if skipped_count:
+            message += f" {skipped_count} packages are already up to date."
+        project.core.ui.echo(message)
 
 
 class Download(BaseCommand):
@@ -119,6 +243,13 @@ class Download(BaseCommand):
             default="./packages",
             type=Path,
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            help="The number of concurrent index lookups and downloads, default to 16",
+            default=16,
+            type=int,
+        )
         parser.add_argument(
             "--python",
             help="Download packages for the given Python range. E.g. '>=3.9'",
@@ -133,9 +264,6 @@ class Download(BaseCommand):
 
     @staticmethod
     def _check_lock_targets(project: Project, env_spec: EnvSpec) -> None:
-        from dep_logic.tags import EnvCompatibility
-        from pdm.exceptions import PdmException
-
         lock_targets = project.get_locked_repository().targets
         ui = project.core.ui
         if env_spec in lock_targets:
@@ -163,16 +291,14 @@ class Download(BaseCommand):
             raise PdmException("No compatible lock target found")
 
     def handle(self, project: Project, options: argparse.Namespace) -> None:
-        from itertools import chain
-
-        from pdm.models.specifiers import PySpecSet
-
+        if options.jobs < 1:
+            raise PdmUsageError("The number of jobs must be a positive integer.")
         env_spec = project.environment.allow_all_spec
 
         if any([options.python, options.platform, options.implementation]):
             replace_dict = {}
             if options.python:
-                if re.match(r"[\d.]+", options.python):
+                if options.python[0].isdigit():
                     options.python = f">={options.python}"
                 replace_dict["requires_python"] = PySpecSet(options.python)
             if options.platform:
@@ -203,59 +329,106 @@ class Download(BaseCommand):
                 ],
             )
         else:
-            hashes = _get_file_hashes(project, all_candidates, env_spec)
-        _download_packages(project, hashes, options.dest)
+            hashes = _get_file_hashes(project, all_candidates, env_spec, options.jobs)
+        _download_packages(project, hashes, options.dest, options.jobs)
 
 
 def _convert_hash_option(hashes: list[FileHash]) -> dict[str, list[str]]:
-    result: dict[str, list[str]] = defaultdict(list)
+    result: dict[str, list[str]] = {}
     for item in hashes:
-        hash_name, hash_value = item["hash"].split(":")
-        result[hash_name].append(hash_value)
+        hash_name, hash_value = item["hash"].split(":", 1)
+        result.setdefault(hash_name, []).append(hash_value)
     return result
 
 
+def _collect_candidate_hashes(
+    project: Project,
+    candidate: Candidate,
+    sources: list[RepositoryConfig],
+    env_spec: EnvSpec,
+    respect_source_order: bool,
+) -> tuple[list[FileHash], list[str]]:
+    """Find the download URLs of the candidate's locked files.
+
+    Return the matched file hashes and the names of the files not found.
+    """
+    hashes: list[FileHash] = []
+    can_hashes = {h["file"]: h for h in candidate.hashes}
+    if not can_hashes or not candidate.req.is_named:
+        return hashes, []
+    req = candidate.req.as_pinned_version(candidate.version)
+    comes_from = candidate.link.comes_from if candidate.link else None
+    if req.is_named and respect_source_order and comes_from:
+        sources = [s for s in sources if comes_from.startswith(s.url)]
+    with project.environment.get_finder(sources, env_spec=env_spec) as finder:
+        for package in finder.find_matches(
+            req.as_line(),
+            allow_yanked=True,
+            allow_prereleases=True,
+            hashes=_convert_hash_option(candidate.hashes),
+        ):
+            filename = package.link.filename
+            match_hash = can_hashes.pop(filename, None)
+            if match_hash:
+                hashes.append(
+                    {
+                        "url": package.link.url_without_fragment,
+                        "file": filename,
+                        "hash": match_hash["hash"],
+                    }
+                )
+    return hashes, list(can_hashes)
+
+
 def _get_file_hashes(
-    project: Project, candidates: Iterable[Candidate], env_spec: EnvSpec
+    project: Project, candidates: Iterable[Candidate], env_spec: EnvSpec, jobs: int
 ) -> list[FileHash]:
     hashes: list[FileHash] = []
     repository = project.get_repository()
+    respect_source_order = project.environment.project.pyproject.settings.get(
+        "resolution", {}
+    ).get("respect-source-order", False)
+    # Candidates of the same package share the same sources
+    sources_by_key: dict[str | None, list[RepositoryConfig]] = {}
+    candidates = list(candidates)
     for candidate in candidates:
-        can_hashes = candidate.hashes[:]
-        if not can_hashes or not candidate.req.is_named:
-            continue
-        req = candidate.req.as_pinned_version(candidate.version)
-        respect_source_order = project.environment.project.pyproject.settings.get(
-            "resolution", {}
-        ).get("respect-source-order", False)
-        sources = repository.get_filtered_sources(candidate.req)
-        comes_from = candidate.link.comes_from if candidate.link else None
-        if req.is_named and respect_source_order and comes_from:
-            sources = [s for s in sources if comes_from.startswith(s.url)]
-        with project.environment.get_finder(sources, env_spec=env_spec) as finder:
-            for package in finder.find_matches(
-                req.as_line(),
-                allow_yanked=True,
-                allow_prereleases=True,
-                hashes=_convert_hash_option(can_hashes),
-            ):
-                filename = package.link.filename
-                match_hash = next(
-                    (h for h in can_hashes if h["file"] == filename), None
-                )
-                if match_hash:
-                    can_hashes.remove(match_hash)
-                    hashes.append(
-                        {
-                            "url": package.link.url_without_fragment,
-                            "file": filename,
-                            "hash": match_hash["hash"],
-                        }
-                    )
-
-            for item in can_hashes:
-                project.core.ui.echo(
-                    f"[warning]File {item['file']} not found on the repository.",
-                    err=True,
-                )
+        if candidate.req.key not in sources_by_key:
+            sources_by_key[candidate.req.key] = repository.get_filtered_sources(
+                candidate.req
+            )
+
+    def collect(candidate: Candidate) -> tuple[list[FileHash], list[str]]:
+        return _collect_candidate_hashes(
+            project,
+            candidate,
+            sources_by_key[candidate.req.key],
+            env_spec,
+            respect_source_order,
+        )
+
+    def consume(future: Future) -> None:
+        found, missing = future.result()
+        hashes.extend(found)
+        for filename in missing:
+            project.core.ui.echo(
+                f"[warning]File {filename} not found on the repository.", err=True
+            )
+
+    # Build the shared session before the workers start, the cached property
+    # is not locked and concurrent finders would each create their own client
+    _ensure_pool_size(project.environment.session, jobs)
+    with ThreadPoolExecutor(jobs) as pool:
+        # Keep at most 2 * jobs lookups queued and consume them in order
+        inflight: deque[Future] = deque()
+        try:
+            for candidate in candidates:
+                if len(inflight) >= 2 * jobs:
+                    consume(inflight.popleft())
+                inflight.append(pool.submit(collect, candidate))
+            while inflight:
+                consume(inflight.popleft())
+        except BaseException:
+            for future in inflight:
+                future.cancel()
+            raise
     return hashes
@@ -28,12 +28,112 @@ def local_file_server():
             thread.join()
 
 
+@pytest.mark.parametrize("jobs_options", [[], ["-j", "1"]])
 @pytest.mark.parametrize("lockfile_options", [[], ["-L", "pdm.static.lock"]])
-def test_download_packages(pdm, tmp_path, lockfile_options):
+def test_download_packages(pdm, tmp_path, lockfile_options, jobs_options):
     old_cwd = os.getcwd()
     os.chdir(PROJECT)
     try:
-        pdm(["download", "-d", str(tmp_path)] + lockfile_options, strict=True)
+        pdm(
+            ["download", "-d", str(tmp_path)] + lockfile_options + jobs_options,
+            strict=True,
+        )
     finally:
         os.chdir(old_cwd)
     assert set(os.listdir(tmp_path)) == set(os.listdir(PACKAGES))
+
+
+def test_download_rejects_non_positive_jobs(pdm, tmp_path):
+    old_cwd = os.getcwd()
+    os.chdir(PROJECT)
+    try:
+        result = pdm(["download", "-d", str(tmp_path), "-j", "0"])
+    finally:
+        os.chdir(old_cwd)
+    assert result.exit_code != 0
+    assert "The number of jobs must be a positive integer." in result.stderr
+    assert not os.listdir(tmp_path)
+
+
+def test_download_skips_up_to_date_files(pdm, tmp_path):
+    old_cwd = os.getcwd()
+    os.chdir(PROJECT)
+    try:
+        pdm(["download", "-d", str(tmp_path)], strict=True)
+        corrupted = tmp_path / "idna-2.10.tar.gz"
+        corrupted.write_bytes(b"corrupted")
+        result = pdm(["download", "-d", str(tmp_path)], strict=True)
+    finally:
+        os.chdir(old_cwd)
+    assert "1 packages downloaded" in result.stdout
+    assert "9 packages are already up to date" in result.stdout
+    assert corrupted.read_bytes() == (PACKAGES / "idna-2.10.tar.gz").read_bytes()
+
+
+def test_download_hash_mismatch_leaves_no_file(tmp_path):
+    import httpx
+
+    from pdm_download.command import _download_package
+
+    package = {
+        "url": "http://127.0.0.1:9876/idna-2.10.tar.gz",
+        "file": "idna-2.10.tar.gz",
+        "hash": "sha256:" + "0" * 64,
+    }
+    with httpx.Client() as session, pytest.raises(RuntimeError, match="doesn't match"):
+        _download_package(session, package, tmp_path)
+    assert not os.listdir(tmp_path)
+
+
+def test_ensure_pool_size_for_requests_session():
+    requests = pytest.importorskip("requests")
+
+    from pdm_download.command import _ensure_pool_size
+
+    with requests.Session() as session:
+        manager = session.get_adapter("https://pypi.org").poolmanager
+        old_pool = manager.connection_from_url("https://pypi.org")
+        _ensure_pool_size(session, 32)
+        new_pool = manager.connection_from_url("https://pypi.org")
+    assert new_pool is not old_pool
+    assert new_pool.pool.maxsize == 32
+
+
+def test_failed_lookup_cancels_pending_lookups(pdm, tmp_path, monkeypatch):
+    from pdm_download import command
+
+    calls = []
+
+    def failing_lookup(*args):
+        calls.append(args)
+        raise RuntimeError("index is down")
+
+    monkeypatch.setattr(command, "_collect_candidate_hashes", failing_lookup)
+    old_cwd = os.getcwd()
+    os.chdir(PROJECT)
+    try:
+        result = pdm(["download", "-d", str(tmp_path), "-j", "1"])
+    finally:
+        os.chdir(old_cwd)
+    assert result.exit_code != 0
+    assert "index is down" in result.stderr
+    # With one job at most two lookups are queued when the first one fails
+    assert len(calls) <= 2
+
+
+def test_download_package_with_requests_session(tmp_path):
+    import hashlib
+
+    requests = pytest.importorskip("requests")
+
+    from pdm_download.command import _download_package
+
+    content = (PACKAGES / "requests-2.24.0.tar.gz").read_bytes()
+    package = {
+        "url": "http://127.0.0.1:9876/requests-2.24.0.tar.gz",
+        "file": "requests-2.24.0.tar.gz",
+        "hash": f"sha256:{hashlib.sha256(content).hexdigest()}",
+    }
+    with requests.Session() as session:
+        assert _download_package(session, package, tmp_path)
+    assert (tmp_path / "requests-2.24.0.tar.gz").read_bytes() == content